@@ -1,10 +1,21 @@
 import asyncio
+import importlib.util
 import os
-from datetime import datetime, timezone
-from typing import Any, Dict, List
-
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputFile, Message, Update
+from contextlib import ExitStack
+from typing import Any, BinaryIO, Dict, Iterable, List, Literal
+
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InputFile,
+    InputMediaAudio,
+    InputMediaVideo,
+    Message,
+    Update,
+)
+from telegram.error import BadRequest
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CallbackQueryHandler,
     CommandHandler,
@@ -12,42 +23,68 @@ from telegram.ext import (
     MessageHandler,
     filters,
 )
-from yt_dlp import YoutubeDL
 
 from .config import (
     AUDIO_KBITRATE,
     CLEANUP_AFTER_SEND,
-    DOWNLOAD_DIR,
     MAX_CONCURRENT_DOWNLOADS,
     MAX_HEIGHT,
     RATE_LIMIT_MAX,
     RATE_LIMIT_WINDOW,
+    TELEGRAM_HTTP2,
     TELEGRAM_MAX_MB,
     TELEGRAM_TOKEN,
+    TELEGRAM_UPLOAD_WORKERS,
+    UPLOAD_TIMEOUT,
     logger,
 )
 from .download import (
-    find_output_files,
+    clear_output_files,
+    estimated_mp3_bytes,
+    fetch_info,
+    find_output_entries,
     force_remove,
+    media_kind,
     pick_files_for_choice,
     safe_cleanup,
     video_height_ladder,
     ytdlp_download_with_progress,
 )
 from .i18n import t
-from .ratelimit import RateLimiter
-from .session import delete_session, load_session, save_session, user_downloads, user_sessions
+from .ratelimit import BotRequestLimiter, RateLimiter
+from .session import (
+    drain_sessions,
+    forget_info,
+    load_session,
+    preload_sessions,
+    recall_info,
+    remember_info,
+    save_session,
+    user_downloads,
+)
 from .utils import (
     ensure_download_dir,
     has_enough_space,
     humanize_duration,
     is_valid_url,
+    now_iso,
     user_download_dir,
 )
 
 # Global concurrency cap: at most MAX_CONCURRENT_DOWNLOADS downloads run at once; the
 # rest wait for a slot (an explicit queue). Created lazily to bind to the running loop.
 _download_slots: "asyncio.Semaphore | None" = None
+# Same idea for uploads: requests from all jobs (and kinds of one job) share the bound.
+_upload_slots: "asyncio.Semaphore | None" = None
+# Most items Telegram accepts in one sendMediaGroup call.
+_MEDIA_GROUP_MAX = 10
+# Size limit for one upload, in bytes.
+_MAX_UPLOAD_BYTES = TELEGRAM_MAX_MB * 1024 * 1024
+# Resolved once: HTTP/2 is only used when enabled and h2 is installed. Long polling
+# (get_updates) keeps HTTP/1.1; a single idle request gains nothing from multiplexing.
+_HTTP_VERSION: Literal["1.1", "2"] = (
+    "2" if TELEGRAM_HTTP2 and importlib.util.find_spec("h2") else "1.1"
+)
 _rate_limiter = RateLimiter(RATE_LIMIT_MAX, RATE_LIMIT_WINDOW)
 
 
@@ -58,44 +95,131 @@ def _slots() -> asyncio.Semaphore:
     return _download_slots
 
 
-def _now() -> str:
-    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+def _uploads() -> asyncio.Semaphore:
+    global _upload_slots
+    if _upload_slots is None:
+        _upload_slots = asyncio.Semaphore(TELEGRAM_UPLOAD_WORKERS)
+    return _upload_slots
+
+
+def _set_status(task: Dict[str, Any], status: str) -> None:
+    task.update(status=status, updated_at=now_iso())
+
 
+def _pick_outputs(vid_id: str, dest_dir: str, choice: str) -> Dict[str, int]:
+    """Picked artifacts for ``choice`` mapped to their size in bytes (one stat per file)."""
+    sizes = dict(find_output_entries(vid_id, dest_dir))
+    return {p: sizes[p] for p in pick_files_for_choice(list(sizes), choice)}
 
-def _exceeds_size_limit(files: List[str]) -> bool:
-    return any((os.path.getsize(fp) / (1024 * 1024)) > TELEGRAM_MAX_MB for fp in files)
+
+def _exceeds_size_limit(sizes: Iterable[int]) -> bool:
+    return any(size > _MAX_UPLOAD_BYTES for size in sizes)
+
+
+def _input_file(f: BinaryIO, path: str, attach: bool = False) -> InputFile:
+    # read_file_handle=False hands the open handle to the HTTP backend, which streams
+    # the multipart body instead of reading the whole (possibly ~2 GB) file into memory.
+    # The handle must therefore stay open until the send call returns.
+    return InputFile(f, filename=os.path.basename(path), attach=attach, read_file_handle=False)
+
+
+async def _send_one(
+    chat_id: int, context: ContextTypes.DEFAULT_TYPE, title: str, path: str
+) -> None:
+    async with _uploads():
+        with open(path, "rb") as f:
+            kind = media_kind(path)
+            if kind == "audio":
+                await context.bot.send_audio(
+                    chat_id=chat_id,
+                    audio=_input_file(f, path),
+                    title=title,
+                    read_timeout=UPLOAD_TIMEOUT,
+                )
+            elif kind == "video":
+                await context.bot.send_video(
+                    chat_id=chat_id,
+                    video=_input_file(f, path),
+                    supports_streaming=True,
+                    read_timeout=UPLOAD_TIMEOUT,
+                )
+            else:
+                await context.bot.send_document(
+                    chat_id=chat_id, document=_input_file(f, path), read_timeout=UPLOAD_TIMEOUT
+                )
+
+
+async def _send_group(
+    chat_id: int, context: ContextTypes.DEFAULT_TYPE, title: str, kind: str, paths: List[str]
+) -> None:
+    """Send same-kind media as one album: a single request instead of one per file."""
+    async with _uploads():
+        with ExitStack() as stack:
+            media: List[InputMediaAudio | InputMediaVideo] = []
+            for path in paths:
+                f = _input_file(stack.enter_context(open(path, "rb")), path, attach=True)
+                if kind == "audio":
+                    media.append(InputMediaAudio(f, title=title))
+                else:
+                    media.append(InputMediaVideo(f, supports_streaming=True))
+            await context.bot.send_media_group(
+                chat_id=chat_id, media=media, read_timeout=UPLOAD_TIMEOUT
+            )
+
+
+async def _report_send_failure(
+    chat_id: int, context: ContextTypes.DEFAULT_TYPE, path: str, error: Exception
+) -> None:
+    logger.warning("Failed to send %s: %s", path, error)
+    await context.bot.send_message(
+        chat_id=chat_id, text=t("send_failed", name=os.path.basename(path), error=error)
+    )
+
+
+async def _send_kind(
+    chat_id: int, context: ContextTypes.DEFAULT_TYPE, title: str, kind: str, paths: List[str]
+) -> None:
+    """Send one kind's files in ``paths`` order, one request after another.
+
+    Same-kind files are usually parts of one download, so they must arrive in sequence:
+    albums of up to _MEDIA_GROUP_MAX items, then any leftover file on its own.
+    """
+    size = 1 if kind == "document" else _MEDIA_GROUP_MAX
+    for i in range(0, len(paths), size):
+        chunk = paths[i : i + size]
+        if len(chunk) > 1:
+            try:
+                await _send_group(chat_id, context, title, kind, chunk)
+                continue
+            except (BadRequest, OSError) as e:
+                # Rejected by Telegram (one bad file fails the whole album) or a file
+                # failed to open: nothing was delivered, so retry its files individually.
+                logger.warning("Failed to send media group %s: %s", chunk, e)
+            except Exception as e:
+                # TimedOut/NetworkError can strike after Telegram accepted the upload;
+                # resending would duplicate the album, so report it instead.
+                for path in chunk:
+                    await _report_send_failure(chat_id, context, path, e)
+                continue
+        for path in chunk:
+            try:
+                await _send_one(chat_id, context, title, path)
+            except Exception as e:
+                await _report_send_failure(chat_id, context, path, e)
 
 
 async def send_files(
     chat_id: int, context: ContextTypes.DEFAULT_TYPE, title: str, files: List[str]
 ) -> None:
+    # Telegram albums hold 2-10 items of one kind (audio can't mix with video). Each kind
+    # is sent in order; different kinds don't depend on each other and upload concurrently,
+    # within the global upload bound. A failed file is reported, the others still go out.
+    by_kind: Dict[str, List[str]] = {}
     for path in files:
-        try:
-            if path.lower().endswith(".mp3"):
-                with open(path, "rb") as f:
-                    await context.bot.send_audio(
-                        chat_id=chat_id,
-                        audio=InputFile(f, filename=os.path.basename(path)),
-                        title=title,
-                    )
-            elif path.lower().endswith((".mp4", ".mkv", ".webm", ".mov")):
-                with open(path, "rb") as f:
-                    await context.bot.send_video(
-                        chat_id=chat_id,
-                        video=InputFile(f, filename=os.path.basename(path)),
-                        supports_streaming=True,
-                    )
-            else:
-                with open(path, "rb") as f:
-                    await context.bot.send_document(
-                        chat_id=chat_id,
-                        document=InputFile(f, filename=os.path.basename(path)),
-                    )
-        except Exception as e:
-            logger.warning("Failed to send %s: %s", path, e)
-            await context.bot.send_message(
-                chat_id=chat_id, text=t("send_failed", name=os.path.basename(path), error=e)
-            )
+        by_kind.setdefault(media_kind(path), []).append(path)
+    await asyncio.gather(
+        *(_send_kind(chat_id, context, title, kind, paths) for kind, paths in by_kind.items())
+    )
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -120,29 +244,28 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     await message.reply_text(t("fetching_info"))
 
     try:
-        # Use a cache directory under DOWNLOAD_DIR to avoid $HOME perms
-        cache = os.path.join(DOWNLOAD_DIR, ".cache", "yt-dlp")
-        os.makedirs(cache, exist_ok=True)
-        with YoutubeDL({"quiet": True, "cachedir": cache, "noplaylist": True}) as ydl:
-            info = ydl.extract_info(url, download=False)
+        # extract_info blocks on the network for up to seconds; keep the event loop free
+        # for other users' callbacks, progress edits and /cancel meanwhile.
+        fetched = await asyncio.get_running_loop().run_in_executor(None, fetch_info, url)
     except Exception as e:
         logger.warning("Info fetch failed for %s: %s", url, e)
         await message.reply_text(t("info_failed"))
         return
 
-    if info is None:
+    if fetched is None:
         await message.reply_text(t("info_failed"))
         return
+    fetched_at, info = fetched
 
     title = info.get("title") or ""
     duration = info.get("duration")
     thumbnail = info.get("thumbnail")
     video_id = info.get("id") or ""
 
-    # Store only what later steps need; the full yt-dlp info dict is large and would
-    # bloat the in-memory cache and the shelve store.
-    user_sessions[user_id] = {"url": url, "title": title, "id": video_id}
-    save_session(user_id, user_sessions[user_id])
+    # Persist only what later steps need; the full yt-dlp info dict is large, so it is
+    # kept in memory just to spare the download step a second extraction.
+    save_session(user_id, {"url": url, "title": title, "id": video_id})
+    remember_info(user_id, info, fetched_at)
 
     keyboard = [
         [InlineKeyboardButton(t("btn_audio"), callback_data="audio")],
@@ -168,7 +291,13 @@ async def download_and_send_task(
     title = session.get("title") or ""
     url = session.get("url") or ""
     vid_id = session.get("id") or ""
+    # Absent after a restart (sessions persist, info does not) or once INFO_TTL has
+    # passed since the probe: yt-dlp re-extracts then. Kept after a finished download, so
+    # picking the other format reuses it too.
+    info = recall_info(user_id)
     dest_dir = user_download_dir(user_id)
+    # Output lookups (stat) and removals go through the executor, off the event loop.
+    loop = asyncio.get_running_loop()
     task = user_downloads.setdefault(
         user_id,
         {
@@ -180,8 +309,8 @@ async def download_and_send_task(
             "files": [],
             "process": None,
             "cancel": False,
-            "created_at": _now(),
-            "updated_at": _now(),
+            "created_at": now_iso(),
+            "updated_at": now_iso(),
         },
     )
 
@@ -202,8 +331,7 @@ async def download_and_send_task(
         async with _slots():
             if task.get("cancel"):
                 raise asyncio.CancelledError()
-            task["status"] = "downloading"
-            task["updated_at"] = _now()
+            _set_status(task, "downloading")
             await edit_caption(t("downloading", title=title, choice=choice))
 
             min_free_mb = max(TELEGRAM_MAX_MB * 2, 2000)
@@ -231,37 +359,56 @@ async def download_and_send_task(
                         task=task,
                         label=label,
                         dest_dir=dest_dir,
+                        info=info,
+                        max_bytes=_MAX_UPLOAD_BYTES,
+                    )
+                    picked = await loop.run_in_executor(
+                        None, _pick_outputs, vid_id, dest_dir, "video"
                     )
-                    files = pick_files_for_choice(find_output_files(vid_id, dest_dir), "video")
+                    files = list(picked)
                     if not files:
                         raise RuntimeError("Downloaded video file not found")
-                    if not _exceeds_size_limit(files):
+                    if not _exceeds_size_limit(picked.values()):
                         break
                     if i < len(ladder) - 1:
-                        force_remove(files)  # discard before retrying at a lower resolution
+                        # discard before retrying at a lower resolution
+                        await loop.run_in_executor(None, force_remove, files)
                 task.setdefault("files", []).extend(files)
-                task["status"] = "sending"
-                task["updated_at"] = _now()
+                _set_status(task, "sending")
                 await send_files(chat_id, context, title, files)
 
             if choice == "audio":
+                kbps = AUDIO_KBITRATE
+                label = "audio"
+                lowered = _exceeds_size_limit([estimated_mp3_bytes(info, kbps)])
+                if lowered:
+                    # The mp3 size follows from the duration: skip a pass that can't fit.
+                    await context.bot.send_message(
+                        chat_id=chat_id, text=t("audio_too_large")
+                    )
+                    kbps = min(AUDIO_KBITRATE, 96)
+                    label = f"audio ({kbps}kbps)"
                 await ytdlp_download_with_progress(
                     url,
                     "audio",
                     max_height=MAX_HEIGHT,
                     edit_caption_coro=edit_caption,
                     task=task,
-                    label="audio",
+                    label=label,
                     dest_dir=dest_dir,
+                    audio_kbps=kbps,
+                    info=info,
                 )
-                files = pick_files_for_choice(find_output_files(vid_id, dest_dir), "audio")
+                picked = await loop.run_in_executor(None, _pick_outputs, vid_id, dest_dir, "audio")
+                files = list(picked)
                 if not files:
                     raise RuntimeError("Downloaded audio file not found")
-                if _exceeds_size_limit(files):
+                if not lowered and _exceeds_size_limit(picked.values()):
                     await context.bot.send_message(
                         chat_id=chat_id, text=t("audio_too_large")
                     )
-                    force_remove(files)  # discard before retrying at a lower bitrate
+                    # discard before retrying at a lower bitrate
+                    await loop.run_in_executor(None, force_remove, files)
                     kbps = min(AUDIO_KBITRATE, 96)
                     await ytdlp_download_with_progress(
                         url,
@@ -272,30 +419,35 @@ async def download_and_send_task(
                         label=f"audio ({kbps}kbps)",
                         dest_dir=dest_dir,
                         audio_kbps=kbps,
+                        info=info,
                     )
-                    files = pick_files_for_choice(find_output_files(vid_id, dest_dir), "audio")
+                    picked = await loop.run_in_executor(
+                        None, _pick_outputs, vid_id, dest_dir, "audio"
+                    )
+                    files = list(picked)
                     if not files:
                         raise RuntimeError("Audio file (lower bitrate) not found")
                 task.setdefault("files", []).extend(files)
-                task["status"] = "sending"
-                task["updated_at"] = _now()
+                _set_status(task, "sending")
                 await send_files(chat_id, context, title, files)
 
-            task["status"] = "done"
-            task["updated_at"] = _now()
+            _set_status(task, "done")
             await edit_caption(t("completed", title=title))
     except asyncio.CancelledError:
-        task["status"] = "canceled"
-        task["updated_at"] = _now()
+        _set_status(task, "canceled")
         await edit_caption(t("canceled"))
     except Exception as e:
-        task["status"] = "error"
-        task["updated_at"] = _now()
+        _set_status(task, "error")
         await edit_caption(t("error", error=e))
+        # Don't retry from probe data this download just failed with.
+        forget_info(user_id, info)  # keeps the info of a URL sent meanwhile
     finally:
+        # The session stays until the next URL replaces it, so the other format can still
+        # be picked for this one.
         if CLEANUP_AFTER_SEND and user_downloads.get(user_id, {}).get("files"):
-            safe_cleanup(list(user_downloads[user_id]["files"]))
-        delete_session(user_id)
+            await loop.run_in_executor(
+                None, safe_cleanup, list(user_downloads[user_id]["files"])
+            )
 
 
 async def handle_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -307,7 +459,7 @@ async def handle_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     choice = query.data
     if choice not in {"audio", "video"}:
         return
-    session = user_sessions.get(user_id) or load_session(user_id)
+    session = load_session(user_id)
 
     if not session:
         await query.edit_message_text(t("session_not_found"))
@@ -341,8 +493,8 @@ async def handle_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         "files": [],
         "process": None,
         "cancel": False,
-        "created_at": _now(),
-        "updated_at": _now(),
+        "created_at": now_iso(),
+        "updated_at": now_iso(),
     }
     await query.edit_message_caption(
         caption=t("queued", title=session.get("title"), choice=choice)
@@ -403,20 +555,35 @@ async def cmd_clear_downloads(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     dest_dir = user_download_dir(user_id)
     ids: List[str] = [i for i in {task.get("id")} if i]
+    loop = asyncio.get_running_loop()
     removed = 0
     for vid in ids:
-        for p in find_output_files(vid, dest_dir):
-            try:
-                os.remove(p)
-                removed += 1
-            except Exception as e:
-                logger.warning("Failed to remove %s: %s", p, e)
+        removed += await loop.run_in_executor(None, clear_output_files, vid, dest_dir)
     task["files"] = []
     await message.reply_text(t("cleared", removed=removed))
 
 
+async def _on_startup(app: Application) -> None:
+    # Warm the session cache so button presses never wait on a database read.
+    preload_sessions()
+
+
+async def _on_shutdown(app: Application) -> None:
+    # Session writes are batched; commit whatever is still pending before exiting.
+    drain_sessions()
+
+
 def run() -> None:
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    app = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .media_write_timeout(UPLOAD_TIMEOUT)
+        .rate_limiter(BotRequestLimiter())
+        .http_version(_HTTP_VERSION)
+        .post_init(_on_startup)
+        .post_shutdown(_on_shutdown)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("downloads", cmd_downloads))
     app.add_handler(CommandHandler("cancel", cmd_cancel))
@@ -47,6 +47,23 @@ VIDEO_HEIGHT_LADDER = _parse_int_list(os.getenv("VIDEO_HEIGHT_LADDER", "720,480,
 AUDIO_KBITRATE = int(os.getenv("AUDIO_KBITRATE", "128"))
 SOCKET_TIMEOUT = int(os.getenv("SOCKET_TIMEOUT", "30"))
 YTDLP_RETRIES = int(os.getenv("YTDLP_RETRIES", "3"))
+# Seconds a probed info dict may be reused. Its signed media URLs expire after hours;
+# past this age a download re-extracts instead.
+INFO_TTL = int(os.getenv("INFO_TTL", "600"))
+# Fragments of an HLS/DASH stream fetched in parallel by yt-dlp.
+YTDLP_FRAG_WORKERS = max(1, int(os.getenv("YTDLP_FRAG_WORKERS", "8")))
+# Hand downloads to aria2c (if it is on PATH) for multi-connection transfers. Off by
+# default: with an external downloader yt-dlp reports no intermediate progress, so the
+# live caption and mid-download /cancel only take effect once the transfer ends.
+USE_ARIA2C = os.getenv("USE_ARIA2C", "false").lower() in {"1", "true", "yes"}
+# Seconds allowed for writing a media upload to Telegram, and for Telegram's reply once
+# the body is sent (it processes the media first). Uploads are streamed from disk, so
+# large files need far more than the library's 20 s write / 5 s read defaults.
+UPLOAD_TIMEOUT = int(os.getenv("UPLOAD_TIMEOUT", "600"))
+# Talk HTTP/2 to the Bot API (needs the optional ``h2`` package, e.g. via
+# python-telegram-bot[http2]): progress edits and uploads share one multiplexed
+# connection instead of one TLS handshake per pooled connection. Ignored without h2.
+TELEGRAM_HTTP2 = os.getenv("TELEGRAM_HTTP2", "false").lower() in {"1", "true", "yes"}
 CLEANUP_AFTER_SEND = os.getenv("CLEANUP_AFTER_SEND", "true").lower() in {
     "1",
     "true",
@@ -55,6 +72,8 @@ CLEANUP_AFTER_SEND = os.getenv("CLEANUP_AFTER_SEND", "true").lower() in {
 
 # Max downloads running concurrently across all users; extra requests wait for a slot.
 MAX_CONCURRENT_DOWNLOADS = max(1, int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "2")))
+# Max media uploads to Telegram in flight at once across all users.
+TELEGRAM_UPLOAD_WORKERS = max(1, int(os.getenv("TELEGRAM_UPLOAD_WORKERS", "4")))
 # Per-user download quota: at most RATE_LIMIT_MAX downloads per RATE_LIMIT_WINDOW seconds.
 # Set RATE_LIMIT_MAX to 0 to disable the quota.
 RATE_LIMIT_MAX = int(os.getenv("RATE_LIMIT_MAX", "5"))
@@ -1,32 +1,191 @@
 import asyncio
-import glob
+import copy
+import functools
+import importlib
 import os
+import shutil
+import threading
 import time
-from datetime import datetime, timezone
-from typing import Any, Callable, Dict, List
-
-from yt_dlp import YoutubeDL
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
 
 from .config import (
     AUDIO_KBITRATE,
     CLEANUP_AFTER_SEND,
     DOWNLOAD_DIR,
+    INFO_TTL,
+    MAX_CONCURRENT_DOWNLOADS,
     SOCKET_TIMEOUT,
+    USE_ARIA2C,
     VIDEO_HEIGHT_LADDER,
+    YTDLP_FRAG_WORKERS,
     YTDLP_RETRIES,
     logger,
 )
 from .i18n import t
-from .utils import sizeof_fmt
+from .utils import now_iso, sizeof_fmt
+
+if TYPE_CHECKING:
+    from yt_dlp import YoutubeDL
 
 # Temporary/partial extensions yt-dlp writes mid-download; never a final artifact.
 _TEMP_EXTS = (".part", ".ytdl", ".temp", ".tmp")
+# Resolved once: aria2c is only used when enabled and actually installed.
+_ARIA2C = USE_ARIA2C and shutil.which("aria2c") is not None
+# 16 connections per file, split into 1 MiB pieces; reserve the whole file up front
+# (fallocate) and buffer writes to keep HDDs from fragmenting and syncing constantly.
+_ARIA2C_ARGS = [
+    "--max-connection-per-server=16",
+    "--split=16",
+    "--min-split-size=1M",
+    "--file-allocation=falloc",
+    "--disk-cache=64M",
+]
+# Extra args for the ffmpeg merge/extract steps. Media goes through files, so the only
+# pipe is stderr, which yt-dlp buffers whole; keep it to errors, without progress stats.
+_FFMPEG_QUIET_ARGS = ["-loglevel", "error", "-nostats"]
+# Native downloader: fetch plain HTTP media in 10 MiB ranged requests.
+_HTTP_CHUNK_SIZE = 10 * 1024 * 1024
+# Initial read/write block of each request (yt-dlp default: 1 KiB). The block adapts to
+# the transfer rate anyway, but every ranged request restarts from this size, so a
+# larger start skips the burst of tiny reads and writes at the head of each chunk.
+_HTTP_BUFFER_SIZE = 64 * 1024
+
+# Idle YoutubeDL instances per (choice, audio_kbps): construction (cookie jar, request
+# handlers, extractor and postprocessor setup) is paid once and reused by later
+# downloads, e.g. the next ladder rung. Instances are not thread-safe, so each one is
+# checked out by a single worker thread at a time. Each one is retired after
+# _YDL_MAX_USES downloads so per-instance state (cookies, caches) can't grow unbounded.
+_YDL_MAX_USES = 50
+_ydl_pool: Dict[Tuple[str, int], List[Tuple["YoutubeDL", int]]] = {}  # (instance, uses)
+_ydl_pool_lock = threading.Lock()
+# Download workers, separate from the loop's default executor: a long yt-dlp/ffmpeg run
+# never holds a thread that metadata probes or other blocking calls are waiting for.
+# Sized to the bot's download slots, so it never queues work of its own.
+_download_pool = ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_DOWNLOADS, thread_name_prefix="ytdlp"
+)
+
+# Minimum seconds between progress caption edits of one download (Telegram throttles
+# frequent edits of the same chat with 429s).
+MIN_EDIT_INTERVAL = 3.0
+# Share of the upload limit reserved for the audio stream of a merged video (1/10: at
+# 1900 MB, 190 MB is hours of audio at typical bitrates).
+_AUDIO_BUDGET_DIVISOR = 10
+# Media kind by lowercase extension; anything else is sent as a document.
+_EXT_KIND = {".mp3": "audio", ".mp4": "video", ".mkv": "video", ".webm": "video", ".mov": "video"}
+
+# Final artifacts per (dest_dir, video_id), as reported by yt-dlp or found by an earlier
+# scan, so the post-download lookups don't re-glob a directory of old downloads.
+_file_index: Dict[Tuple[str, str], Set[str]] = {}
+
+# Recent metadata probes with their (monotonic) probe time, most recently used last:
+# users often resend a link within minutes. Keyed by "extractor:id" when the URL names
+# one video (see _info_cache_key), else by the URL itself. Entries are large (every
+# format of the video), hence the small cap; INFO_TTL stays far below media URL expiry.
+_INFO_CACHE_MAX = 32
+_info_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_info_cache_lock = threading.Lock()
 
 
 def build_outtmpl(dest_dir: str) -> str:
     return os.path.join(dest_dir, "%(title).80s-%(id)s.%(ext)s")
 
 
+@functools.cache
+def _youtube_dl() -> "type[YoutubeDL]":
+    # yt_dlp pulls in hundreds of extractor modules; import it on first use so importing
+    # this package (tests, tooling) stays cheap.
+    cls: "type[YoutubeDL]" = importlib.import_module("yt_dlp").YoutubeDL
+    return cls
+
+
+@functools.cache
+def _download_error() -> "type[Exception]":
+    cls: "type[Exception]" = importlib.import_module("yt_dlp.utils").DownloadError
+    return cls
+
+
+@functools.cache
+def _ensure_dir(path: str) -> str:
+    # Created once per process; yt-dlp recreates its cache dir itself if it disappears.
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def ytdlp_cache_dir() -> str:
+    # Force yt-dlp cache under download dir to avoid permission issues in containers
+    return _ensure_dir(os.path.join(DOWNLOAD_DIR, ".cache", "yt-dlp"))
+
+
+@functools.cache
+def _extractors() -> Tuple[Any, ...]:
+    # The extractor classes yt-dlp itself tries, in its order (Generic last).
+    return tuple(importlib.import_module("yt_dlp.extractor").gen_extractor_classes())
+
+
+@functools.lru_cache(maxsize=256)
+def _info_cache_key(url: str) -> Optional[str]:
+    """``extractor:id`` read from ``url`` alone, or ``None`` if the URL carries no id.
+
+    Lets trivial variants of one link (tracking params, youtu.be vs watch?v=) share a
+    cache entry. Only a guess: fetch_info stores under it once a probe confirms it.
+    """
+    for ie in _extractors():
+        if ie.suitable(url):
+            video_id = ie.get_temp_id(url)
+            return f"{ie.ie_key()}:{video_id}" if video_id else None
+    return None
+
+
+def fetch_info(url: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+    """Extract metadata for ``url`` without downloading. Blocking: run it in an executor.
+
+    Returns the (monotonic) time of the probe along with the info: a cached result is
+    as old as that probe. Results are kept for ``INFO_TTL`` seconds and shared across
+    users and worker threads. The dict is sanitized to plain data before it is published,
+    and must then never be mutated: downloads process a deep copy of it.
+    """
+    now = time.monotonic()
+    key = _info_cache_key(url)
+    with _info_cache_lock:
+        for k in filter(None, (key, url)):
+            hit = _info_cache.get(k)
+            if hit is not None and now - hit[0] < INFO_TTL:
+                _info_cache.move_to_end(k)
+                return hit
+    opts = {
+        "quiet": True,
+        "cachedir": ytdlp_cache_dir(),
+        "noplaylist": True,
+        "socket_timeout": SOCKET_TIMEOUT,
+        # Metadata probe only: never fetch media, don't resolve playlist entries.
+        "skip_download": True,
+        "extract_flat": "discard_in_playlist",
+    }
+    with _youtube_dl()(opts) as ydl:
+        raw = ydl.extract_info(url, download=False)
+        # sanitize_info() writes defaults into its argument: run it here, while the dict
+        # is still private to this thread, so the shared copy is only ever read.
+        info: Optional[Dict[str, Any]] = ydl.sanitize_info(raw)
+    if not info:
+        return None
+    # The id guessed from the URL is trusted only if the probe returned that very video;
+    # e.g. for watch?v=X&list=Y the guess is the playlist, the probe is video X.
+    probed = f"{info.get('extractor_key')}:{info.get('id')}"
+    if key != probed or info.get("_type", "video") != "video":
+        key = url
+    entry = (now, info)
+    with _info_cache_lock:
+        _info_cache[key] = entry
+        _info_cache.move_to_end(key)
+        while len(_info_cache) > _INFO_CACHE_MAX:
+            _info_cache.popitem(last=False)
+    return entry
+
+
 def video_height_ladder(max_height: int) -> List[int]:
     """Descending, distinct video heights to try, all capped at max_height.
 
@@ -38,27 +197,101 @@ def video_height_ladder(max_height: int) -> List[int]:
     return sorted(rungs, reverse=True)
 
 
-def build_format_string(choice: str, max_height: int) -> str:
+@functools.lru_cache(maxsize=32)
+def build_format_string(choice: str, max_height: int, max_bytes: Optional[int] = None) -> str:
     if choice == "audio":
         return "bestaudio/best"
-    return f"bestvideo[height<={max_height}]+bestaudio/best[height<={max_height}]/best"
+    fallback = f"bestvideo[height<={max_height}]+bestaudio/best[height<={max_height}]/best"
+    if not max_bytes:
+        return fallback
+    # Skip formats whose (approximate) size is known to exceed the limit, so an oversized
+    # pick falls to a smaller format in the same pass instead of a wasted download. Unknown
+    # sizes pass ("<=?"), and the unfiltered selectors stay as the last resort. Separate
+    # streams are merged, so the limit is split: the audio keeps a fixed share of it and
+    # the video only gets the rest.
+    audio_bytes = max_bytes // _AUDIO_BUDGET_DIVISOR
+    video_bytes = max_bytes - audio_bytes
+
+    def fits(limit: int) -> str:
+        return f"[filesize<=?{limit}][filesize_approx<=?{limit}]"
+
+    return (
+        f"bestvideo[height<={max_height}]{fits(video_bytes)}+bestaudio{fits(audio_bytes)}"
+        f"/best[height<={max_height}]{fits(max_bytes)}/{fallback}"
+    )
+
+
+def estimated_mp3_bytes(info: Optional[Dict[str, Any]], kbps: int) -> int:
+    """Size of the extracted mp3: a constant-bitrate encode, so duration × bitrate (0 if
+    the duration is unknown)."""
+    return int(float((info or {}).get("duration") or 0) * kbps * 125)
+
+
+def record_output_files(video_id: str, dest_dir: str, paths: List[str]) -> None:
+    _file_index.setdefault((dest_dir, video_id), set()).update(paths)
+
+
+def forget_output_files(video_id: str, dest_dir: str) -> None:
+    _file_index.pop((dest_dir, video_id), None)
+
+
+def find_output_entries(video_id: str, dest_dir: str) -> List[Tuple[str, int]]:
+    """Final artifacts for ``video_id`` in ``dest_dir`` as sorted ``(path, size)`` pairs.
+
+    Costs one stat per artifact: sizes come from the same stat that validates an index
+    entry, or from the directory scan that finds the files.
+    """
+    out: List[Tuple[str, int]] = []
+    indexed = _file_index.get((dest_dir, video_id))
+    if indexed:
+        # Entries go stale when files are removed; drop those, rescan if none are left.
+        for p in sorted(indexed):
+            try:
+                out.append((p, os.stat(p).st_size))
+            except FileNotFoundError:
+                indexed.discard(p)
+        if out:
+            return out
+    needle = f"-{video_id}."
+    try:
+        with os.scandir(dest_dir) as it:
+            for e in it:
+                name = e.name
+                if needle in name and not name.startswith(".") and e.is_file():
+                    if not name.lower().endswith(_TEMP_EXTS):
+                        out.append((e.path, e.stat().st_size))
+    except FileNotFoundError:
+        return []
+    out.sort()
+    if out:
+        record_output_files(video_id, dest_dir, [p for p, _ in out])
+    return out
 
 
 def find_output_files(video_id: str, dest_dir: str) -> List[str]:
-    pattern = os.path.join(dest_dir, f"*-{video_id}.*")
-    files = glob.glob(pattern)
-    return sorted(p for p in files if not p.lower().endswith(_TEMP_EXTS))
+    return [p for p, _ in find_output_entries(video_id, dest_dir)]
+
+
+def media_kind(path: str) -> str:
+    """``"audio"``, ``"video"`` or ``"document"``, from the file extension."""
+    return _EXT_KIND.get(os.path.splitext(path)[1].lower(), "document")
 
 
 def pick_files_for_choice(files: List[str], choice: str) -> List[str]:
-    if choice == "audio":
-        return [p for p in files if p.lower().endswith(".mp3")]
-    if choice == "video":
-        vids = [p for p in files if p.lower().endswith(".mp4")]
-        if vids:
-            return vids
-        return [p for p in files if p.lower().endswith((".mkv", ".webm", ".mov"))]
-    return []
+    if choice not in {"audio", "video"}:
+        return []
+    picked: List[str] = []
+    other_video: List[str] = []
+    for p in files:
+        ext = os.path.splitext(p)[1].lower()
+        if _EXT_KIND.get(ext) != choice:
+            continue
+        # Video prefers .mp4 and only falls back to other containers when there's none.
+        if choice == "video" and ext != ".mp4":
+            other_video.append(p)
+        else:
+            picked.append(p)
+    return picked or other_video
 
 
 def safe_cleanup(paths: List[str]) -> None:
@@ -82,6 +315,24 @@ def force_remove(paths: List[str]) -> None:
             logger.warning("Failed to remove %s: %s", p, e)
 
 
+def clear_output_files(video_id: str, dest_dir: str) -> int:
+    """Delete every artifact of ``video_id`` in ``dest_dir``; returns how many were removed.
+
+    The index only knows what this process recorded, so clearing forces a fresh scan to
+    catch every residue, and drops the entry afterwards so no stale paths remain.
+    """
+    forget_output_files(video_id, dest_dir)
+    removed = 0
+    for p in find_output_files(video_id, dest_dir):
+        try:
+            os.remove(p)
+            removed += 1
+        except OSError as e:
+            logger.warning("Failed to remove %s: %s", p, e)
+    forget_output_files(video_id, dest_dir)
+    return removed
+
+
 def build_ydl_progress_opts(
     choice: str,
     *,
@@ -89,11 +340,9 @@ def build_ydl_progress_opts(
     progress_hook: Callable[[Dict[str, Any]], None],
     dest_dir: str,
     audio_kbps: int = AUDIO_KBITRATE,
+    max_bytes: Optional[int] = None,
 ) -> Dict[str, Any]:
-    fmt = build_format_string("video" if choice == "video" else "audio", max_height)
-    # Force yt-dlp cache under download dir to avoid permission issues in containers
-    cache_dir = os.path.join(DOWNLOAD_DIR, ".cache", "yt-dlp")
-    os.makedirs(cache_dir, exist_ok=True)
+    fmt = build_format_string("video" if choice == "video" else "audio", max_height, max_bytes)
     opts: Dict[str, Any] = {
         "format": fmt,
         "outtmpl": build_outtmpl(dest_dir),
@@ -101,14 +350,26 @@ def build_ydl_progress_opts(
         "noplaylist": True,
         "socket_timeout": SOCKET_TIMEOUT,
         "retries": YTDLP_RETRIES,
-        "concurrent_fragment_downloads": 3,
+        # No default when embedded (only the CLI sets 10): a failed HLS/DASH fragment
+        # would otherwise be skipped on the first error, leaving a gap in the output.
+        "fragment_retries": YTDLP_RETRIES,
+        "concurrent_fragment_downloads": YTDLP_FRAG_WORKERS,
+        "http_chunk_size": _HTTP_CHUNK_SIZE,
+        "buffersize": _HTTP_BUFFER_SIZE,
         "merge_output_format": "mp4" if choice == "video" else None,
         "noprogress": False,
         "quiet": True,
         "no_warnings": True,
         "progress_hooks": [progress_hook],
-        "cachedir": cache_dir,
+        "cachedir": ytdlp_cache_dir(),
+        "postprocessor_args": {
+            "merger": list(_FFMPEG_QUIET_ARGS),
+            "extractaudio": list(_FFMPEG_QUIET_ARGS),
+        },
     }
+    if _ARIA2C:
+        opts["external_downloader"] = {"default": "aria2c"}
+        opts["external_downloader_args"] = {"aria2c": list(_ARIA2C_ARGS)}
     if choice == "audio":
         opts.setdefault("postprocessors", []).append(
             {
@@ -120,16 +381,49 @@ def build_ydl_progress_opts(
     return opts
 
 
+@contextmanager
+def _pooled_ydl(key: Tuple[str, int], opts: Dict[str, Any]) -> Iterator["YoutubeDL"]:
+    """Check out a YoutubeDL for ``key`` configured with the per-download ``opts``.
+
+    Only format, output template and progress hooks vary within a key; they are
+    re-applied on reuse. An instance that raised, or reached its use limit, is closed
+    rather than returned.
+    """
+    with _ydl_pool_lock:
+        idle = _ydl_pool.get(key)
+        ydl, uses = idle.pop() if idle else (None, 0)
+    if ydl is None:
+        ydl = _youtube_dl()(opts)
+    else:
+        ydl.params["format"] = opts["format"]
+        ydl.format_selector = ydl.build_format_selector(opts["format"])
+        ydl.params["outtmpl"]["default"] = opts["outtmpl"]
+        ydl.params["progress_hooks"] = opts["progress_hooks"]
+        ydl._progress_hooks[:] = opts["progress_hooks"]
+    try:
+        yield ydl
+    except BaseException:
+        ydl.close()
+        raise
+    uses += 1
+    if uses >= _YDL_MAX_USES:
+        ydl.close()
+        return
+    with _ydl_pool_lock:
+        _ydl_pool.setdefault(key, []).append((ydl, uses))
+
+
 def make_progress_hook(
-    loop: asyncio.AbstractEventLoop,
-    edit_caption_coro: Callable[[str], Any],
+    post_caption: Callable[[str], None],
     task: Dict[str, Any],
     label: str,
 ) -> Callable[[Dict[str, Any]], None]:
-    state: Dict[str, float] = {"last_t": 0.0, "last_pct": -1}
+    """Build a yt-dlp progress hook; ``post_caption`` must be safe to call from any thread."""
+    # Reports are spaced like the caption edits they feed: anything posted faster would
+    # only wake the event loop to be overwritten in the editor's queue.
+    state: Dict[str, float] = {"last_t": 0.0}
 
     def hook(d: Dict[str, Any]) -> None:
-        task["updated_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
         if task.get("cancel"):
             raise RuntimeError("cancelled")
         status = d.get("status")
@@ -139,25 +433,41 @@ def make_progress_hook(
             pct = int(downloaded * 100 / total) if total else None
             spd = d.get("speed")
             eta = d.get("eta")
-            now = time.time()
-            if pct is not None and (pct >= state["last_pct"] + 5 or now - state["last_t"] > 2):
-                state["last_pct"] = pct
+            now = time.monotonic()
+            if pct is not None and now - state["last_t"] >= MIN_EDIT_INTERVAL:
                 state["last_t"] = now
+                # Refreshed only when progress is reported, not on every hook call.
+                task["updated_at"] = now_iso()
                 parts = [f"⬇️ {label}: {pct}%"]
                 if spd:
                     parts.append(f"{sizeof_fmt(float(spd))}/s")
                 if eta:
                     parts.append(f"ETA {int(eta)}s")
-                txt = " • ".join(parts)
-                loop.call_soon_threadsafe(asyncio.create_task, edit_caption_coro(txt))
+                post_caption(" • ".join(parts))
         elif status == "finished":
-            loop.call_soon_threadsafe(
-                asyncio.create_task, edit_caption_coro(t("processing", label=label))
-            )
+            task["updated_at"] = now_iso()
+            post_caption(t("processing", label=label))
 
     return hook
 
 
+def _offer_latest(queue: "asyncio.Queue[str]", text: str) -> None:
+    # Single-slot queue: a newer caption replaces one the editor hasn't picked up yet.
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(text)
+
+
+async def _caption_editor(
+    queue: "asyncio.Queue[str]", edit_caption_coro: Callable[[str], Any]
+) -> None:
+    """Apply queued captions one at a time, spaced to stay under Telegram's edit limits."""
+    while True:
+        text = await queue.get()
+        await edit_caption_coro(text)
+        await asyncio.sleep(MIN_EDIT_INTERVAL)
+
+
 async def ytdlp_download_with_progress(
     url: str,
     choice: str,
@@ -168,25 +478,62 @@ async def ytdlp_download_with_progress(
     label: str,
     dest_dir: str,
     audio_kbps: int = AUDIO_KBITRATE,
+    info: Optional[Dict[str, Any]] = None,
+    max_bytes: Optional[int] = None,
 ) -> None:
+    """Download ``url`` in a worker thread, reporting progress through the task caption.
+
+    When ``info`` (the dict from an earlier ``extract_info(download=False)``) is given,
+    yt-dlp processes it directly instead of re-extracting the page and player again.
+    ``max_bytes`` steers video format selection away from formats known to be larger.
+    """
     loop = asyncio.get_running_loop()
-    hook = make_progress_hook(loop, edit_caption_coro, task, label)
+    captions: "asyncio.Queue[str]" = asyncio.Queue(maxsize=1)
+    # Bound once: the hook posts from the worker thread on every reported tick.
+    call_soon = loop.call_soon_threadsafe
+
+    def post_caption(text: str) -> None:
+        call_soon(_offer_latest, captions, text)
+
+    hook = make_progress_hook(post_caption, task, label)
     opts = build_ydl_progress_opts(
         choice,
         max_height=max_height,
         progress_hook=hook,
         dest_dir=dest_dir,
         audio_kbps=audio_kbps,
+        max_bytes=max_bytes,
     )
 
     def run() -> None:
         os.makedirs(dest_dir, exist_ok=True)
-        with YoutubeDL(opts) as ydl:
-            ydl.download([url])
+        with _pooled_ydl((choice, audio_kbps), opts) as ydl:
+            if info is None:
+                result = ydl.extract_info(url, download=True)
+            else:
+                # Work on a private copy: processing mutates the dict, and the cached
+                # info is shared with other downloads (see fetch_info).
+                try:
+                    result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+                except _download_error():
+                    if task.get("cancel"):
+                        raise
+                    # Typically an HTTP 403 on a signed media URL that expired since the
+                    # probe; re-extract like yt-dlp's own download_with_info_file does.
+                    logger.info("Download from cached info failed, re-extracting %s", url)
+                    result = ydl.extract_info(url, download=True)
+        # Each requested download carries its final path (after merge/extract/move).
+        if result and result.get("id"):
+            produced = [d["filepath"] for d in result.get("requested_downloads") or []]
+            record_output_files(result["id"], dest_dir, [p for p in produced if p])
 
+    editor = asyncio.create_task(_caption_editor(captions, edit_caption_coro))
     try:
-        await loop.run_in_executor(None, run)
+        await loop.run_in_executor(_download_pool, run)
     except Exception as e:
         if str(e) == "cancelled":
             raise asyncio.CancelledError() from None
         raise
+    finally:
+        # Pending progress is stale once the download is over; the caller edits next.
+        editor.cancel()
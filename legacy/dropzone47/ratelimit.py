@@ -1,6 +1,11 @@
+import asyncio
 import time
 from collections import defaultdict, deque
-from typing import Deque, Dict
+from datetime import timedelta
+from typing import Any, Callable, Coroutine, Deque, Dict, List, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
 
 
 class RateLimiter:
@@ -38,3 +43,79 @@ class RateLimiter:
         if not events or len(events) < self.max_events:
             return 0
         return max(0, int(self.window - (self._now() - events[0])))
+
+
+class BotRequestLimiter(BaseRateLimiter[None]):
+    """Spaces outgoing Bot API requests to stay under Telegram's flood limits.
+
+    Requests start at most ``overall_per_second`` per second in total, and one per
+    ``group_interval`` seconds per group chat (private chats only share the overall
+    budget). A ``RetryAfter`` pauses all requests for the time Telegram asks, then the
+    rejected one is retried, up to ``max_retries`` times. Each request reserves its start
+    slot up front, so concurrent senders queue in order instead of polling.
+    """
+
+    def __init__(
+        self,
+        overall_per_second: float = 30,
+        group_interval: float = 3.0,
+        max_retries: int = 1,
+    ) -> None:
+        self._overall_interval = 1 / overall_per_second
+        self._group_interval = group_interval
+        self._max_retries = max_retries
+        self._next_overall = 0.0
+        self._next_group: Dict[Union[int, str], float] = {}
+
+    def _now(self) -> float:
+        return time.monotonic()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._next_group.clear()
+
+    def _reserve(self, chat_id: Optional[Union[int, str]]) -> float:
+        """Claim the next start slot for a request to ``chat_id``; returns the wait."""
+        now = self._now()
+        # The overall slot is taken at the earliest free time, even when the group wait
+        # pushes the real start later, so a busy group never holds back other chats.
+        slot = max(now, self._next_overall)
+        self._next_overall = slot + self._overall_interval
+        start = slot
+        # Negative ids are groups/channels; string ids are channel usernames.
+        if chat_id is not None and (isinstance(chat_id, str) or chat_id < 0):
+            start = max(start, self._next_group.get(chat_id, 0.0))
+            self._next_group[chat_id] = start + self._group_interval
+            if len(self._next_group) > 1000:
+                for key in [k for k, t in self._next_group.items() if t <= now]:
+                    del self._next_group[key]
+        return start - now
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Any]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: None,
+    ) -> Union[bool, Dict[str, Any], List[Any]]:
+        chat_id = data.get("chat_id")
+        attempt = 0
+        while True:
+            delay = self._reserve(chat_id)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self._max_retries:
+                    raise
+                attempt += 1
+                # Flood control applies to the whole bot: hold back every sender, this
+                # retry included (its next reservation lands after the pause).
+                wait = e.retry_after
+                seconds = wait.total_seconds() if isinstance(wait, timedelta) else float(wait)
+                self._next_overall = max(self._next_overall, self._now() + seconds)
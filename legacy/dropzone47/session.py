@@ -1,39 +1,165 @@
+import asyncio
 import json
 import os
 import sqlite3
-from typing import Any, Dict, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
 
-from .config import SESSIONS_DB, logger
+from .config import INFO_TTL, SESSIONS_DB, logger
 
-# In-memory session cache (persisted to SQLite for resilience across restarts).
+# In-memory session cache, authoritative while the process runs. Every change is written
+# through to SQLite so sessions survive restarts.
 user_sessions: Dict[int, Dict[str, Any]] = {}
 
+# Full yt-dlp info dicts from the last extracted URL with their (monotonic) probe time,
+# kept in memory only (too large to persist) so the download step can skip re-extracting
+# the same page. Reused until INFO_TTL after the probe at most, see recall_info().
+user_infos: Dict[int, Tuple[float, Dict[str, Any]]] = {}
+
 # Track per-user active/finished downloads for listing and cancellation.
 user_downloads: Dict[int, Dict[str, Any]] = {}
 
 # SQLite file derived from the SESSIONS_DB base path.
 _DB_PATH = f"{SESSIONS_DB}.sqlite3"
 
+# One connection for the life of the process: opening the file and re-running the
+# schema statement on every handler turn dominated the cost of a session update.
+# Shared by the event loop (cache misses) and the writer thread, hence the lock.
+_conn: Optional[sqlite3.Connection] = None
+_conn_path = ""
+_conn_lock = threading.RLock()
+
+# Changes are coalesced per user and committed in batches, one transaction every
+# _FLUSH_DELAY seconds at most, by a single worker thread off the event loop.
+_FLUSH_DELAY = 0.2
+_pending: Dict[int, Optional[Dict[str, Any]]] = {}  # user_id -> data; None means delete
+_pending_lock = threading.Lock()
+_flush_scheduled = False
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sessions")
+
+# Set once preload_sessions() has read every persisted row into the cache; from then on
+# a cache miss means "no session" and never touches the database.
+_preloaded = False
+
 
 def _connect() -> sqlite3.Connection:
+    global _conn, _conn_path
+    if _conn is not None and _conn_path == _DB_PATH:
+        return _conn
+    close()
     parent = os.path.dirname(_DB_PATH)
     if parent:
         os.makedirs(parent, exist_ok=True)
-    conn = sqlite3.connect(_DB_PATH)
+    conn = sqlite3.connect(_DB_PATH, check_same_thread=False)
+    # WAL: cache-miss reads don't wait on a flush in progress, and a commit is one append
+    # to the log. NORMAL syncs at checkpoints only; a crash can lose the last batch, but
+    # sessions are short-lived button state the user can recreate by resending the URL.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
     conn.execute(
         "CREATE TABLE IF NOT EXISTS sessions (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)"
     )
+    _conn, _conn_path = conn, _DB_PATH
     return conn
 
 
+def close() -> None:
+    """Close the shared connection; the next session call reopens it."""
+    global _conn
+    with _conn_lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+
+def _queue_write(user_id: int, data: Optional[Dict[str, Any]]) -> None:
+    """Record the latest state for ``user_id`` (``None`` deletes) for the next batch."""
+    global _flush_scheduled
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # No event loop (tests, tooling): write synchronously.
+        _apply_batch({user_id: data})
+        return
+    with _pending_lock:
+        _pending[user_id] = data
+        if _flush_scheduled:
+            return
+        _flush_scheduled = True
+    loop.call_later(_FLUSH_DELAY, _writer.submit, flush_sessions)
+
+
+def flush_sessions() -> None:
+    """Commit all pending session changes now, in a single transaction."""
+    global _flush_scheduled
+    with _pending_lock:
+        batch = dict(_pending)
+        _pending.clear()
+        _flush_scheduled = False
+    if batch:
+        _apply_batch(batch)
+
+
+def drain_sessions() -> None:
+    """Flush pending changes on the writer thread and wait for it (use at shutdown).
+
+    Going through the writer keeps the single-writer order: a batch it already popped
+    is committed before this newer one, never after it.
+    """
+    _writer.submit(flush_sessions).result()
+
+
+def _apply_batch(batch: Dict[int, Optional[Dict[str, Any]]]) -> None:
+    saves = [(uid, json.dumps(data)) for uid, data in batch.items() if data is not None]
+    deletes = [(uid,) for uid, data in batch.items() if data is None]
+    try:
+        with _conn_lock, _connect() as conn:
+            if saves:
+                conn.executemany(
+                    "INSERT INTO sessions (user_id, data) VALUES (?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
+                    saves,
+                )
+            if deletes:
+                conn.executemany("DELETE FROM sessions WHERE user_id = ?", deletes)
+    except Exception as e:
+        logger.warning("Failed to persist %d session change(s): %s", len(batch), e)
+
+
+def preload_sessions() -> None:
+    """Read all persisted sessions into the cache; call once at startup."""
+    global _preloaded
+    try:
+        with _conn_lock, _connect() as conn:
+            rows = conn.execute("SELECT user_id, data FROM sessions").fetchall()
+        for uid, data in rows:
+            user_sessions.setdefault(uid, json.loads(data))
+    except Exception as e:
+        logger.warning("Failed to preload sessions: %s", e)
+        return
+    _preloaded = True
+
+
 def load_session(user_id: int) -> Optional[Dict[str, Any]]:
+    cached = user_sessions.get(user_id)
+    if cached is not None:
+        return cached
+    with _pending_lock:
+        if user_id in _pending:  # deleted, not yet flushed: the row on disk is stale
+            return _pending[user_id]
+    if _preloaded:
+        return None
+    # Cache miss: only after a restart, for a session saved by the previous process.
     try:
-        with _connect() as conn:
+        with _conn_lock, _connect() as conn:
             row = conn.execute(
                 "SELECT data FROM sessions WHERE user_id = ?", (user_id,)
             ).fetchone()
         if row is not None:
             data: Dict[str, Any] = json.loads(row[0])
+            user_sessions[user_id] = data
             return data
     except Exception as e:
         logger.warning("Failed to load session %s: %s", user_id, e)
@@ -41,20 +167,36 @@ def load_session(user_id: int) -> Optional[Dict[str, Any]]:
 
 
 def save_session(user_id: int, data: Dict[str, Any]) -> None:
-    try:
-        with _connect() as conn:
-            conn.execute(
-                "INSERT INTO sessions (user_id, data) VALUES (?, ?) "
-                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
-                (user_id, json.dumps(data)),
-            )
-    except Exception as e:
-        logger.warning("Failed to save session %s: %s", user_id, e)
+    user_sessions[user_id] = data
+    _queue_write(user_id, data)
 
 
 def delete_session(user_id: int) -> None:
-    try:
-        with _connect() as conn:
-            conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
-    except Exception as e:
-        logger.warning("Failed to delete session %s: %s", user_id, e)
+    user_sessions.pop(user_id, None)
+    _queue_write(user_id, None)
+
+
+def remember_info(user_id: int, info: Dict[str, Any], fetched_at: float) -> None:
+    """Keep ``info``, probed at ``fetched_at`` (monotonic), for the user's next download.
+
+    Everyone's expired entries are dropped on the way.
+    """
+    now = time.monotonic()
+    for uid in [u for u, (stored, _) in user_infos.items() if now - stored >= INFO_TTL]:
+        del user_infos[uid]
+    user_infos[user_id] = (fetched_at, info)
+
+
+def recall_info(user_id: int) -> Optional[Dict[str, Any]]:
+    """The user's stored info, or ``None`` once it is too old to trust its media URLs."""
+    entry = user_infos.get(user_id)
+    if entry is None or time.monotonic() - entry[0] >= INFO_TTL:
+        return None
+    return entry[1]
+
+
+def forget_info(user_id: int, info: Optional[Dict[str, Any]]) -> None:
+    """Drop the user's stored info if it is still ``info`` (not a newer URL's) or expired."""
+    entry = user_infos.get(user_id)
+    if entry is not None and (entry[1] is info or time.monotonic() - entry[0] >= INFO_TTL):
+        del user_infos[user_id]
@@ -1,6 +1,7 @@
 import os
 import shutil
-from typing import Optional
+import time
+from typing import Dict, Optional
 from urllib.parse import urlparse
 
 from .config import DOWNLOAD_DIR
@@ -40,18 +41,46 @@ def humanize_duration(seconds: Optional[int]) -> str:
     return f"{m:02d}:{s:02d}"
 
 
+# Free space changes slowly compared to how often jobs start, so a burst of downloads
+# shares one statvfs() result for _DISK_CACHE_TTL seconds.
+_DISK_CACHE_TTL = 1.0
+_disk_cache: Dict[str, float] = {"t": 0.0, "free": 0.0}
+
+
 def has_enough_space(min_free_mb: int) -> bool:
-    try:
-        usage = shutil.disk_usage(DOWNLOAD_DIR)
-        return usage.free >= min_free_mb * 1024 * 1024
-    except FileNotFoundError:
-        return True
+    now = time.monotonic()
+    if not _disk_cache["t"] or now - _disk_cache["t"] >= _DISK_CACHE_TTL:
+        try:
+            _disk_cache["free"] = shutil.disk_usage(DOWNLOAD_DIR).free
+        except FileNotFoundError:
+            return True
+        _disk_cache["t"] = now
+    return _disk_cache["free"] >= min_free_mb * 1024 * 1024
 
 
-def sizeof_fmt(num: float) -> str:
-    for unit in ["B", "KB", "MB", "GB"]:
-        if num < 1024.0:
-            return f"{num:.1f} {unit}"
-        num /= 1024.0
-    return f"{num:.1f} TB"
+_iso_second = -1
+_iso_text = ""
+
+
+def now_iso() -> str:
+    """Current UTC time as ISO-8601 at second precision, formatted once per second.
 
+    Same shape as ``datetime.now(timezone.utc).isoformat(timespec="seconds")``; called
+    from the progress hook on every tick, so the string is reused within a second.
+    """
+    global _iso_second, _iso_text
+    t = int(time.time())
+    if t != _iso_second:
+        _iso_text = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(t))
+        _iso_second = t
+    return _iso_text
+
+
+_SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
+
+
+def sizeof_fmt(num: float) -> str:
+    # Every 10 bits of the integer part is one 1024 step, so the unit comes straight
+    # from the bit length instead of a divide-and-compare loop.
+    idx = min(max(int(num).bit_length() - 1, 0) // 10, len(_SIZE_UNITS) - 1)
+    return f"{num / (1 << (10 * idx)):.1f} {_SIZE_UNITS[idx]}"
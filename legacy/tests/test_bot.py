@@ -0,0 +1,206 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from typing import Any, List
+from unittest import mock
+
+from telegram import Message
+from telegram.error import BadRequest, NetworkError, TimedOut
+
+from dropzone47 import bot, session
+
+
+class TestDownloadTaskSession(unittest.TestCase):
+    def _run_task(self, during_download: Any) -> None:
+        async def fake_download(*args: Any, **kwargs: Any) -> None:
+            during_download()
+            raise RuntimeError("boom")  # end the task early; the finally block still runs
+
+        context = mock.MagicMock()
+        context.bot = mock.AsyncMock()
+        current = session.load_session(1)
+        assert current is not None
+        with (
+            mock.patch.object(bot, "ytdlp_download_with_progress", fake_download),
+            mock.patch.object(bot, "has_enough_space", return_value=True),
+            mock.patch.object(bot, "_download_slots", None),
+        ):
+            asyncio.run(bot.download_and_send_task(1, 10, 20, context, "audio", current))
+
+    def test_url_sent_during_download_keeps_new_session(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "sessions.sqlite3")
+            with (
+                mock.patch.object(session, "_DB_PATH", db),
+                mock.patch.object(bot, "user_download_dir", return_value=tmp),
+                mock.patch.dict(session.user_sessions, clear=True),
+                mock.patch.dict(session.user_downloads, clear=True),
+                mock.patch.dict(session._pending, clear=True),
+                mock.patch.object(session, "_flush_scheduled", False),
+            ):
+                session.save_session(1, {"url": "A", "title": "A", "id": "a"})
+                self._run_task(lambda: session.save_session(1, {"url": "B", "title": "B"}))
+                self.assertEqual(session.load_session(1), {"url": "B", "title": "B"})
+
+    def test_both_formats_can_be_picked_for_one_url(self) -> None:
+        async def fake_download(*args: Any, **kwargs: Any) -> None:
+            pass
+
+        async def scenario(context: Any) -> List[str]:
+            picked = []
+            for choice in ("audio", "video"):
+                query = mock.MagicMock()
+                query.answer = mock.AsyncMock()
+                query.edit_message_text = mock.AsyncMock()
+                query.edit_message_caption = mock.AsyncMock()
+                query.from_user.id = 1
+                query.data = choice
+                query.message = mock.MagicMock(spec=Message, chat_id=10, message_id=20)
+                query.message.reply_text = mock.AsyncMock()
+                await bot.handle_choice(mock.MagicMock(callback_query=query), context)
+                query.edit_message_text.assert_not_called()  # no session_not_found
+                await bot.user_downloads[1]["async_task"]
+                picked.append(bot.user_downloads[1]["status"])
+            return picked
+
+        context = mock.MagicMock()
+        context.bot = mock.AsyncMock()
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "sessions.sqlite3")
+            path = os.path.join(tmp, "clip-a.mp4")
+            with (
+                mock.patch.object(session, "_DB_PATH", db),
+                mock.patch.object(bot, "user_download_dir", return_value=tmp),
+                mock.patch.dict(session.user_sessions, clear=True),
+                mock.patch.dict(session.user_downloads, clear=True),
+                mock.patch.dict(session._pending, clear=True),
+                mock.patch.object(session, "_flush_scheduled", False),
+                mock.patch.object(bot, "ytdlp_download_with_progress", fake_download),
+                mock.patch.object(bot, "_pick_outputs", return_value={path: 1}),
+                mock.patch.object(bot, "send_files", new_callable=mock.AsyncMock) as send,
+                mock.patch.object(bot, "has_enough_space", return_value=True),
+                mock.patch.object(bot, "_download_slots", None),
+                mock.patch.object(bot._rate_limiter, "allow", return_value=True),
+            ):
+                session.save_session(1, {"url": "A", "title": "A", "id": "a"})
+                self.assertEqual(asyncio.run(scenario(context)), ["done", "done"])
+                self.assertEqual(send.await_count, 2)
+                self.assertEqual(session.load_session(1), {"url": "A", "title": "A", "id": "a"})
+
+class TestSendFiles(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        patcher = mock.patch.object(bot, "_upload_slots", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.context = mock.MagicMock()
+        self.context.bot = mock.AsyncMock()
+
+    def _files(self, *names: str) -> List[str]:
+        paths = [os.path.join(self.dir, name) for name in names]
+        for path in paths:
+            with open(path, "wb") as f:
+                f.write(b"x")
+        return paths
+
+    def _send(self, files: List[str]) -> None:
+        asyncio.run(bot.send_files(10, self.context, "T", files))
+
+    def test_same_kind_files_go_out_as_one_album(self) -> None:
+        self._send(self._files("a.mp4", "b.mp4", "c.mp4"))
+        self.context.bot.send_media_group.assert_awaited_once()
+        media = self.context.bot.send_media_group.await_args.kwargs["media"]
+        self.assertEqual([m.media.filename for m in media], ["a.mp4", "b.mp4", "c.mp4"])
+        self.context.bot.send_video.assert_not_awaited()
+
+    def test_eleven_files_become_an_album_and_a_single(self) -> None:
+        files = self._files(*(f"{i:02}.mp3" for i in range(11)))
+        self._send(files)
+        self.context.bot.send_media_group.assert_awaited_once()
+        self.assertEqual(len(self.context.bot.send_media_group.await_args.kwargs["media"]), 10)
+        self.context.bot.send_audio.assert_awaited_once()
+        self.assertEqual(self.context.bot.send_audio.await_args.kwargs["audio"].filename, "10.mp3")
+
+    def test_documents_and_mixed_kinds_are_never_grouped(self) -> None:
+        self._send(self._files("a.txt", "b.txt", "c.mp3", "d.mp4"))
+        self.context.bot.send_media_group.assert_not_awaited()
+        self.assertEqual(self.context.bot.send_document.await_count, 2)
+        self.context.bot.send_audio.assert_awaited_once()
+        self.context.bot.send_video.assert_awaited_once()
+
+    def test_rejected_album_falls_back_to_single_sends_once(self) -> None:
+        self.context.bot.send_media_group.side_effect = BadRequest("bad file")
+        with self.assertLogs(bot.logger, "WARNING"):
+            self._send(self._files("a.mp4", "b.mp4"))
+        self.context.bot.send_media_group.assert_awaited_once()
+        self.assertEqual(self.context.bot.send_video.await_count, 2)
+        self.context.bot.send_message.assert_not_awaited()
+
+    def test_timed_out_album_is_reported_not_resent(self) -> None:
+        self.context.bot.send_media_group.side_effect = TimedOut()
+        with self.assertLogs(bot.logger, "WARNING"):
+            self._send(self._files("a.mp4", "b.mp4"))
+        self.context.bot.send_video.assert_not_awaited()
+        texts = [c.kwargs["text"] for c in self.context.bot.send_message.await_args_list]
+        self.assertEqual(len(texts), 2)
+        self.assertIn("a.mp4", texts[0])
+
+    def test_uploads_in_flight_stay_within_the_global_bound(self) -> None:
+        in_flight, peak = 0, 0
+
+        async def send_video(**kwargs: Any) -> None:
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+        async def scenario() -> None:
+            jobs = [self._files(f"{i}.mp4") for i in range(5)]
+            await asyncio.gather(*(bot.send_files(10, self.context, "T", f) for f in jobs))
+
+        self.context.bot.send_video.side_effect = send_video
+        with mock.patch.object(bot, "TELEGRAM_UPLOAD_WORKERS", 2):
+            asyncio.run(scenario())
+        self.assertEqual(self.context.bot.send_video.await_count, 5)
+        self.assertEqual(peak, 2)
+
+    def test_failed_file_is_reported_and_the_others_delivered(self) -> None:
+        self.context.bot.send_audio.side_effect = NetworkError("reset")
+        with self.assertLogs(bot.logger, "WARNING"):
+            self._send(self._files("a.mp3", "b.mp4", "c.txt"))
+        self.context.bot.send_video.assert_awaited_once()
+        self.context.bot.send_document.assert_awaited_once()
+        self.context.bot.send_message.assert_awaited_once()
+        self.assertIn("a.mp3", self.context.bot.send_message.await_args.kwargs["text"])
+
+    def test_files_of_one_kind_arrive_in_order(self) -> None:
+        sent: List[str] = []
+
+        def recorder(field: str, *delays: float) -> Any:
+            pending = list(delays)
+
+            async def send(**kwargs: Any) -> None:
+                # Earlier requests take longer: sent at once, they would land out of order.
+                await asyncio.sleep(pending.pop(0) if pending else 0.0)
+                items = kwargs["media"] if field == "media" else [kwargs[field]]
+                sent.extend(getattr(m, "media", m).filename for m in items)
+
+            return send
+
+        self.context.bot.send_media_group.side_effect = recorder("media", 0.02)
+        self.context.bot.send_audio.side_effect = recorder("audio", 0.0)
+        self.context.bot.send_document.side_effect = recorder("document", 0.03, 0.02, 0.01)
+        names = [f"{i:02}.mp3" for i in range(11)]
+        self._send(self._files(*names))
+        self.assertEqual(sent, names)
+        sent.clear()
+        self._send(self._files("x.txt", "y.txt", "z.txt"))
+        self.assertEqual(sent, ["x.txt", "y.txt", "z.txt"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,9 @@
+import asyncio
 import os
 import tempfile
 import unittest
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
 from unittest import mock
 
 from dropzone47 import download
@@ -55,6 +58,162 @@ class TestFindOutputFiles(unittest.TestCase):
                 find_output_files("SAME", user_b), [os.path.join(user_b, "clip-SAME.mp4")]
             )
 
+    def test_entries_report_sizes(self) -> None:
+        with tempfile.TemporaryDirectory() as dest:
+            path = os.path.join(dest, "clip-SZ1.mp4")
+            with open(path, "wb") as f:
+                f.write(b"x" * 123)
+            self.assertEqual(download.find_output_entries("SZ1", dest), [(path, 123)])
+            self.assertEqual(download.find_output_entries("SZ1", os.path.join(dest, "no")), [])
+
+    def test_uses_recorded_files_and_rescans_when_stale(self) -> None:
+        with tempfile.TemporaryDirectory() as dest, mock.patch.dict(download._file_index):
+            recorded = os.path.join(dest, "clip-IDX1.mp3")
+            _touch(recorded)
+            download.record_output_files("IDX1", dest, [recorded])
+            # A file the index doesn't know about is not found while the index is valid.
+            _touch(os.path.join(dest, "clip-IDX1.mp4"))
+            self.assertEqual(find_output_files("IDX1", dest), [recorded])
+
+            os.remove(recorded)
+            self.assertEqual(find_output_files("IDX1", dest), [os.path.join(dest, "clip-IDX1.mp4")])
+
+    def test_forget_forces_rescan(self) -> None:
+        with tempfile.TemporaryDirectory() as dest, mock.patch.dict(download._file_index):
+            recorded = os.path.join(dest, "clip-IDX2.mp3")
+            other = os.path.join(dest, "clip-IDX2.mp4")
+            _touch(recorded)
+            _touch(other)
+            download.record_output_files("IDX2", dest, [recorded])
+            download.forget_output_files("IDX2", dest)
+            self.assertEqual(find_output_files("IDX2", dest), [recorded, other])
+
+    def test_clear_removes_unindexed_residue(self) -> None:
+        with tempfile.TemporaryDirectory() as dest, mock.patch.dict(download._file_index):
+            recorded = os.path.join(dest, "clip-CLR1.mp3")
+            _touch(recorded)
+            _touch(os.path.join(dest, "clip-CLR1.mp4"))
+            _touch(os.path.join(dest, "other-CLR2.mp4"))
+            download.record_output_files("CLR1", dest, [recorded])
+            self.assertEqual(download.clear_output_files("CLR1", dest), 2)
+            self.assertEqual(os.listdir(dest), ["other-CLR2.mp4"])
+            self.assertNotIn((dest, "CLR1"), download._file_index)
+
+
+class TestFetchInfoCache(unittest.TestCase):
+    def test_caches_per_url_until_ttl(self) -> None:
+        ydl = mock.MagicMock()
+        ydl.__enter__.return_value.extract_info.side_effect = lambda url, download: {"id": url}
+        ydl.__enter__.return_value.sanitize_info.side_effect = lambda d: dict(d, _type="video")
+        extract = ydl.__enter__.return_value.extract_info
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            mock.patch.object(download, "DOWNLOAD_DIR", tmp),
+            mock.patch.object(download, "_youtube_dl", return_value=lambda opts: ydl),
+            mock.patch.object(download, "_info_cache", download.OrderedDict()),
+            mock.patch.object(download, "_INFO_CACHE_MAX", 1),
+            mock.patch.object(download.time, "monotonic", return_value=100.0) as clock,
+        ):
+            first = download.fetch_info("u1")
+            # Sanitized before caching, returned with the probe time.
+            self.assertEqual(first, (100.0, {"id": "u1", "_type": "video"}))
+            clock.return_value = 150.0
+            self.assertIs(download.fetch_info("u1"), first)  # as old as the probe
+            self.assertEqual(extract.call_count, 1)
+            download.fetch_info("u2")  # evicts u1 (cap of one entry)
+            download.fetch_info("u1")
+            self.assertEqual(extract.call_count, 3)
+            clock.return_value = 150.0 + download.INFO_TTL
+            download.fetch_info("u1")  # expired
+            self.assertEqual(extract.call_count, 4)
+
+    def test_url_variants_of_one_video_share_an_entry(self) -> None:
+        def extract_info(url: str, download: bool) -> Dict[str, Any]:
+            video_id = "PL1" if "/playlist" in url else "dQw4w9WgXcQ"
+            kind = "playlist" if "/playlist" in url else "video"
+            key = "YoutubeTab" if "/playlist" in url else "Youtube"
+            return {"id": video_id, "extractor_key": key, "_type": kind}
+
+        ydl = mock.MagicMock()
+        ydl.__enter__.return_value.extract_info.side_effect = extract_info
+        ydl.__enter__.return_value.sanitize_info.side_effect = lambda d: d
+        extract = ydl.__enter__.return_value.extract_info
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            mock.patch.object(download, "DOWNLOAD_DIR", tmp),
+            mock.patch.object(download, "_youtube_dl", return_value=lambda opts: ydl),
+            mock.patch.object(download, "_info_cache", download.OrderedDict()),
+        ):
+            first = download.fetch_info("https://youtu.be/dQw4w9WgXcQ?si=share")
+            again = download.fetch_info("https://www.youtube.com/watch?v=dQw4w9WgXcQ")
+            self.assertIs(again, first)
+            self.assertEqual(extract.call_count, 1)
+            # The playlist guessed from this URL is not the video it resolves to.
+            download.fetch_info("https://www.youtube.com/playlist?list=PL1")
+            download.fetch_info("https://www.youtube.com/watch?v=aaaaaaaaaaa&list=PL1")
+            self.assertEqual(extract.call_count, 3)
+
+
+class TestDownloadFromInfo(unittest.TestCase):
+    def test_falls_back_to_extraction_when_cached_info_fails(self) -> None:
+        ydl = mock.MagicMock()
+        ydl.process_ie_result.side_effect = download._download_error()("HTTP Error 403")
+        ydl.extract_info.return_value = {"id": "v1", "requested_downloads": []}
+
+        @contextmanager
+        def pooled(key: Any, opts: Any) -> Iterator[Any]:
+            yield ydl
+
+        async def edit(text: str) -> None:
+            pass
+
+        info: Dict[str, Any] = {"id": "v1", "formats": [{"format_id": "a"}]}
+        with tempfile.TemporaryDirectory() as tmp:
+            with (
+                mock.patch.object(download, "DOWNLOAD_DIR", tmp),
+                mock.patch.object(download, "_pooled_ydl", pooled),
+            ):
+                asyncio.run(
+                    download.ytdlp_download_with_progress(
+                        "https://example.com/v1",
+                        "audio",
+                        max_height=720,
+                        edit_caption_coro=edit,
+                        task={},
+                        label="audio",
+                        dest_dir=tmp,
+                        info=info,
+                    )
+                )
+        ydl.extract_info.assert_called_once_with("https://example.com/v1", download=True)
+        # The shared info dict is never handed to yt-dlp itself, only a copy.
+        self.assertIsNot(ydl.process_ie_result.call_args.args[0], info)
+        self.assertEqual(info, {"id": "v1", "formats": [{"format_id": "a"}]})
+
+
+class TestSizedFormatSelection(unittest.TestCase):
+    def _select(self, formats: List[Dict[str, Any]]) -> List[str]:
+        ydl = download._youtube_dl()({"quiet": True})
+        selector = ydl.build_format_selector(download.build_format_string("video", 720, 1000))
+        ctx = {
+            "formats": [
+                dict(f, url="https://x/" + f["format_id"], protocol="https") for f in formats
+            ],
+            "has_merged_format": False,
+            "incomplete_formats": False,
+        }
+        return [f["format_id"] for f in selector(ctx)]
+
+    def test_video_that_fits_alone_but_not_with_audio_is_skipped(self) -> None:
+        audio = {"format_id": "a", "ext": "m4a", "vcodec": "none", "acodec": "mp4a"}
+        video = {"ext": "mp4", "height": 720, "vcodec": "avc1", "acodec": "none"}
+        formats = [
+            dict(audio, filesize=100),
+            dict(video, format_id="small", filesize=800),
+            dict(video, format_id="big", filesize=950),  # fits 1000 alone, not with audio
+        ]
+        self.assertEqual(self._select(formats), ["small+a"])
+
 
 class TestVideoHeightLadder(unittest.TestCase):
     def test_descending_and_capped(self) -> None:
@@ -106,6 +265,88 @@ class TestYdlOpts(unittest.TestCase):
             self.assertNotIn("postprocessors", opts)
             self.assertEqual(opts["merge_output_format"], "mp4")
 
+    def test_fragment_workers_and_aria2c(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            with (
+                mock.patch.object(download, "DOWNLOAD_DIR", tmp),
+                mock.patch.object(download, "YTDLP_FRAG_WORKERS", 12),
+                mock.patch.object(download, "_ARIA2C", True),
+            ):
+                opts = build_ydl_progress_opts(
+                    "video",
+                    max_height=480,
+                    progress_hook=lambda d: None,
+                    dest_dir=os.path.join(tmp, "7"),
+                )
+            self.assertEqual(opts["concurrent_fragment_downloads"], 12)
+            self.assertEqual(opts["fragment_retries"], download.YTDLP_RETRIES)
+            self.assertEqual(opts["external_downloader"], {"default": "aria2c"})
+            self.assertIn("aria2c", opts["external_downloader_args"])
+
+
+class TestProgressHook(unittest.TestCase):
+    def test_reports_at_most_once_per_edit_interval(self) -> None:
+        posted: List[str] = []
+        hook = download.make_progress_hook(posted.append, {}, "video")
+        with mock.patch.object(download.time, "monotonic", return_value=1000.0):
+            for i in range(100):
+                hook({"status": "downloading", "downloaded_bytes": i, "total_bytes": 100})
+        self.assertEqual(len(posted), 1)
+        later = 1000.0 + download.MIN_EDIT_INTERVAL
+        with mock.patch.object(download.time, "monotonic", return_value=later):
+            hook({"status": "downloading", "downloaded_bytes": 100, "total_bytes": 100})
+        self.assertEqual(len(posted), 2)
+        self.assertIn("100%", posted[-1])
+
+
+class TestYdlPool(unittest.TestCase):
+    def _opts(self, tmp: str, height: int, hook: Any) -> Dict[str, Any]:
+        with mock.patch.object(download, "DOWNLOAD_DIR", tmp):
+            return build_ydl_progress_opts(
+                "video", max_height=height, progress_hook=hook, dest_dir=os.path.join(tmp, "7")
+            )
+
+    def test_reuses_instance_with_fresh_per_download_options(self) -> None:
+        def first(d: Dict[str, Any]) -> None:
+            pass
+
+        def second(d: Dict[str, Any]) -> None:
+            pass
+
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(download._ydl_pool):
+            key = ("video", 128)
+            with download._pooled_ydl(key, self._opts(tmp, 720, first)) as ydl_a:
+                pass
+            opts = self._opts(tmp, 480, second)
+            with download._pooled_ydl(key, opts) as ydl_b:
+                self.assertIs(ydl_b, ydl_a)
+                self.assertEqual(ydl_b._progress_hooks, [second])
+                self.assertEqual(ydl_b.params["format"], opts["format"])
+
+    def test_failed_instance_is_not_reused(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(download._ydl_pool):
+            key = ("video", 128)
+            with self.assertRaises(RuntimeError):
+                with download._pooled_ydl(key, self._opts(tmp, 720, lambda d: None)):
+                    raise RuntimeError("boom")
+            self.assertEqual(download._ydl_pool.get(key, []), [])
+
+    def test_instance_retired_after_max_uses(self) -> None:
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            mock.patch.dict(download._ydl_pool),
+            mock.patch.object(download, "_YDL_MAX_USES", 2),
+        ):
+            key = ("video", 128)
+            opts = self._opts(tmp, 720, lambda d: None)
+            with download._pooled_ydl(key, opts) as first:
+                pass
+            with download._pooled_ydl(key, opts) as again:
+                self.assertIs(again, first)
+            self.assertEqual(download._ydl_pool.get(key, []), [])
+            with download._pooled_ydl(key, opts) as fresh:
+                self.assertIsNot(fresh, first)
+
 
 if __name__ == "__main__":
     unittest.main()
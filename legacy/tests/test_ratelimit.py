@@ -1,6 +1,11 @@
+import asyncio
 import unittest
+from typing import Any, List
+from unittest import mock
 
-from dropzone47.ratelimit import RateLimiter
+from telegram.error import RetryAfter
+
+from dropzone47.ratelimit import BotRequestLimiter, RateLimiter
 
 
 class TestRateLimiter(unittest.TestCase):
@@ -29,5 +34,44 @@ class TestRateLimiter(unittest.TestCase):
         self.assertTrue(rl.allow(1))
 
 
+class TestBotRequestLimiter(unittest.TestCase):
+    def _limiter(self, clock: List[float]) -> BotRequestLimiter:
+        rl = BotRequestLimiter(overall_per_second=10, group_interval=3.0)
+        rl._now = lambda: clock[0]  # type: ignore[method-assign]
+        return rl
+
+    def test_spaces_overall_and_group_requests(self) -> None:
+        rl = self._limiter([100.0])
+        self.assertEqual(rl._reserve(1), 0)
+        self.assertAlmostEqual(rl._reserve(2), 0.1)  # private chats: overall budget only
+        self.assertAlmostEqual(rl._reserve(-5), 0.2)
+        self.assertAlmostEqual(rl._reserve(-5), 3.2)  # same group: group interval
+        self.assertAlmostEqual(rl._reserve(None), 0.4)  # not held back by the group's wait
+
+    def test_retry_after_pauses_then_retries(self) -> None:
+        clock = [100.0]
+        rl = self._limiter(clock)
+        calls: List[Any] = []
+
+        async def callback(**kwargs: Any) -> bool:
+            calls.append(kwargs)
+            if len(calls) == 1:
+                raise RetryAfter(5)
+            return True
+
+        sleeps: List[float] = []
+
+        async def fake_sleep(delay: float) -> None:
+            sleeps.append(delay)
+
+        with mock.patch("dropzone47.ratelimit.asyncio.sleep", fake_sleep):
+            result = asyncio.run(
+                rl.process_request(callback, (), {"text": "x"}, "sendMessage", {"chat_id": 1}, None)
+            )
+        self.assertTrue(result)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sleeps, [5.0])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import tempfile
 import unittest
@@ -26,6 +27,106 @@ class TestSessionStore(unittest.TestCase):
                 session.delete_session(42)
                 self.assertIsNone(session.load_session(42))
 
+    def test_connection_uses_wal(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "sessions.sqlite3")
+            with mock.patch.object(session, "_DB_PATH", db), session._conn_lock:
+                conn = session._connect()
+                self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+                session.close()
+
+    def test_cache_miss_reads_persisted_row(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "sessions.sqlite3")
+            with (
+                mock.patch.object(session, "_DB_PATH", db),
+                mock.patch.dict(session.user_sessions, clear=True),
+            ):
+                session.save_session(7, {"url": "u", "title": "T", "id": "vid"})
+                # Simulate a restart: the in-memory cache is gone, the row is not.
+                session.user_sessions.clear()
+                self.assertEqual(session.load_session(7), {"url": "u", "title": "T", "id": "vid"})
+                self.assertIn(7, session.user_sessions)
+                session.delete_session(7)
+                session.user_sessions.clear()
+                self.assertIsNone(session.load_session(7))
+
+    def test_preload_fills_cache_and_skips_db_on_miss(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "sessions.sqlite3")
+            with (
+                mock.patch.object(session, "_DB_PATH", db),
+                mock.patch.object(session, "_preloaded", False),
+                mock.patch.dict(session.user_sessions, clear=True),
+            ):
+                session.save_session(5, {"id": "p"})
+                session.user_sessions.clear()
+                session.preload_sessions()
+                self.assertEqual(session.user_sessions, {5: {"id": "p"}})
+                with mock.patch.object(session, "_connect") as connect:
+                    self.assertIsNone(session.load_session(6))
+                connect.assert_not_called()
+                session.delete_session(5)
+
+    def test_writes_inside_event_loop_are_batched(self) -> None:
+        async def scenario() -> None:
+            session.save_session(1, {"id": "a"})
+            session.save_session(1, {"id": "b"})  # coalesced with the first
+            session.save_session(2, {"id": "c"})
+            session.delete_session(2)
+            self.assertEqual(session._pending, {1: {"id": "b"}, 2: None})
+            # Deleted but not yet flushed: must not resurrect a stale row.
+            self.assertIsNone(session.load_session(2))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "sessions.sqlite3")
+            with (
+                mock.patch.object(session, "_DB_PATH", db),
+                mock.patch.dict(session.user_sessions, clear=True),
+            ):
+                asyncio.run(scenario())
+                session.drain_sessions()
+                session.user_sessions.clear()
+                self.assertEqual(session.load_session(1), {"id": "b"})
+                self.assertIsNone(session.load_session(2))
+                session.delete_session(1)
+
+
+class TestUserInfos(unittest.TestCase):
+    def test_info_expires_after_ttl(self) -> None:
+        info = {"id": "x"}
+        with (
+            mock.patch.dict(session.user_infos, clear=True),
+            mock.patch.object(session.time, "monotonic", return_value=100.0) as clock,
+        ):
+            session.remember_info(1, info, 100.0)
+            self.assertIs(session.recall_info(1), info)
+            clock.return_value = 100.0 + session.INFO_TTL
+            self.assertIsNone(session.recall_info(1))
+            # Storing another user's info prunes the expired entry.
+            session.remember_info(2, {"id": "y"}, clock.return_value)
+            self.assertNotIn(1, session.user_infos)
+
+    def test_info_ages_from_the_probe_not_from_storing(self) -> None:
+        with (
+            mock.patch.dict(session.user_infos, clear=True),
+            mock.patch.object(session.time, "monotonic", return_value=100.0) as clock,
+        ):
+            # A cached probe handed out just before it expires stays just as old.
+            session.remember_info(1, {"id": "x"}, 100.0 - session.INFO_TTL + 1)
+            self.assertIsNotNone(session.recall_info(1))
+            clock.return_value = 101.0
+            self.assertIsNone(session.recall_info(1))
+
+    def test_forget_keeps_newer_info(self) -> None:
+        old, new = {"id": "a"}, {"id": "b"}
+        with mock.patch.dict(session.user_infos, clear=True):
+            session.remember_info(1, new, session.time.monotonic())
+            session.forget_info(1, old)
+            self.assertIs(session.recall_info(1), new)
+            session.forget_info(1, new)
+            self.assertNotIn(1, session.user_infos)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,10 +1,24 @@
 import os
 import tempfile
 import unittest
+from datetime import datetime, timezone
 from unittest import mock
 
-from dropzone47.download import build_format_string, pick_files_for_choice
-from dropzone47.utils import humanize_duration, is_valid_url, sizeof_fmt, user_download_dir
+from dropzone47 import utils
+from dropzone47.download import (
+    build_format_string,
+    estimated_mp3_bytes,
+    media_kind,
+    pick_files_for_choice,
+)
+from dropzone47.utils import (
+    has_enough_space,
+    humanize_duration,
+    is_valid_url,
+    now_iso,
+    sizeof_fmt,
+    user_download_dir,
+)
 
 
 class TestUtils(unittest.TestCase):
@@ -17,12 +31,25 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(sizeof_fmt(500), "500.0 B")
         self.assertEqual(sizeof_fmt(1536), "1.5 KB")
         self.assertEqual(sizeof_fmt(1048576), "1.0 MB")
+        self.assertEqual(sizeof_fmt(0), "0.0 B")
+        self.assertEqual(sizeof_fmt(1023.5), "1023.5 B")
+        self.assertEqual(sizeof_fmt(1024**5), "1024.0 TB")
 
     def test_build_format_string(self) -> None:
         self.assertEqual(build_format_string("audio", 720), "bestaudio/best")
         fmt = build_format_string("video", 480)
         self.assertIn("bestvideo[height<=480]", fmt)
         self.assertIn("+bestaudio", fmt)
+        self.assertNotIn("filesize", fmt)
+        sized = build_format_string("video", 480, 1000)
+        self.assertTrue(sized.startswith("bestvideo[height<=480][filesize<=?900]"))
+        self.assertIn("+bestaudio[filesize<=?100]", sized)
+        self.assertTrue(sized.endswith("/" + fmt))  # unfiltered selectors remain as fallback
+
+    def test_estimated_mp3_bytes(self) -> None:
+        self.assertEqual(estimated_mp3_bytes({"duration": 60}, 128), 960_000)
+        self.assertEqual(estimated_mp3_bytes({"duration": None}, 128), 0)
+        self.assertEqual(estimated_mp3_bytes(None, 128), 0)
 
     def test_pick_files_for_choice(self) -> None:
         files = [
@@ -34,6 +61,14 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(pick_files_for_choice(files, "audio"), ["/tmp/audio-abc.mp3"])
         self.assertEqual(pick_files_for_choice(files, "video"), ["/tmp/video-abc.mp4"])
         self.assertEqual(pick_files_for_choice(files, "noop"), [])
+        # Without an .mp4, other video containers are accepted.
+        self.assertEqual(pick_files_for_choice(files[1:], "video"), ["/tmp/video-abc.webm"])
+
+    def test_media_kind(self) -> None:
+        self.assertEqual(media_kind("/tmp/a-x.MP3"), "audio")
+        self.assertEqual(media_kind("/tmp/a-x.mkv"), "video")
+        self.assertEqual(media_kind("/tmp/a-x.txt"), "document")
+        self.assertEqual(media_kind("/tmp/mp4"), "document")
 
     def test_is_valid_url(self) -> None:
         self.assertTrue(is_valid_url("https://youtu.be/abc"))
@@ -50,6 +85,23 @@ class TestUtils(unittest.TestCase):
             self.assertEqual(path, os.path.join(tmp, "4242"))
             self.assertTrue(os.path.isdir(path))
 
+    def test_has_enough_space_caches_disk_usage(self) -> None:
+        usage = mock.Mock(free=10 * 1024 * 1024)
+        with (
+            mock.patch.dict(utils._disk_cache, {"t": 0.0, "free": 0.0}),
+            mock.patch("dropzone47.utils.shutil.disk_usage", return_value=usage) as du,
+        ):
+            self.assertTrue(has_enough_space(5))
+            self.assertFalse(has_enough_space(20))
+            # Both checks within the TTL share a single statvfs() call.
+            du.assert_called_once()
+
+    def test_now_iso_matches_datetime_format(self) -> None:
+        with mock.patch("dropzone47.utils.time.time", return_value=1_700_000_000.7):
+            got = now_iso()
+        want = datetime.fromtimestamp(1_700_000_000, timezone.utc).isoformat(timespec="seconds")
+        self.assertEqual(got, want)
+
 
 if __name__ == "__main__":
     unittest.main()